@@ -4,17 +4,19 @@ Simple mesh client - send and receive packets via TCP
 """
 
 import base64
+import functools
 import hashlib
-import random
+import hmac
+import os
+import selectors
 import socket
 import struct
 import sys
-import threading
 import time
 from datetime import datetime
+from itertools import accumulate
 
 from Crypto.Cipher import AES
-from Crypto.Hash import HMAC, SHA256
 
 # Constants
 ROUTE_FLOOD = 0x01
@@ -29,12 +31,30 @@ CIPHER_MAC_SIZE = 2
 CIPHER_KEY_SIZE = 16
 PUB_KEY_SIZE = 32
 
+# RS232Bridge framing
+RS232_MAGIC = b"\xC0\x3E"
+RECV_SLAB_SIZE = 64 * 1024       # bytes requested per recv_into
+RECV_COMPACT_THRESHOLD = 64 * 1024  # consumed bytes kept before compacting
+SOCK_RCVBUF_SIZE = 256 * 1024    # kernel receive buffer for bursts
+MAX_PACKET_SIZE = 256  # MAX_TRANS_UNIT + 1, the bridge firmware's limit
+
+# Precompiled struct formats
+_U16BE = struct.Struct(">H")
+_U32LE = struct.Struct("<I")
+_RS232_HEADER = struct.Struct(">2sH")  # magic, packet length
+
+# RX display
+_BAR = "=" * 60
+_ROUTE_NAMES = {0: "DIRECT", 1: "FLOOD", 2: "TRANSPORT"}
+_TYPE_NAMES = {0: "TXT_MSG", 3: "ACK", 4: "ADVERT", 5: "GRP_TXT"}
+
+
 def fletcher16(data):
     """Calculate Fletcher-16 checksum"""
-    sum1 = sum2 = 0
-    for byte in data:
-        sum1 = (sum1 + byte) % 255
-        sum2 = (sum2 + sum1) % 255
+    # mod 255 distributes over the sums, so reduce once at the end:
+    # sum1 is the byte sum, sum2 the sum of all running prefix sums.
+    sum1 = sum(data) % 255
+    sum2 = sum(accumulate(data)) % 255
     return bytes([sum2, sum1])
 
 
@@ -50,106 +70,211 @@ def get_public_channel_hash(secret):
     return sha.digest()[0]
 
 
+# The public PSK is fixed, so decode and hash it once at import
+_PUBLIC_SECRET = get_public_channel_secret()
+_PUBLIC_CHANNEL_HASH = get_public_channel_hash(_PUBLIC_SECRET)
+
+
+@functools.lru_cache(maxsize=4)
+def _cipher_for(key):
+    """Cached AES-128 ECB cipher (ECB keeps no state between calls)."""
+    return AES.new(key, AES.MODE_ECB)
+
+
+@functools.lru_cache(maxsize=4)
+def _hmac_for(key):
+    """Cached HMAC-SHA256 with the ipad/opad key blocks already absorbed.
+
+    copy() it before use, it is stateful.
+    """
+    return hmac.new(key, digestmod=hashlib.sha256)
+
+
+def _padded_buffer(data, offset=0, block_size=16):
+    """Zeroed bytearray holding data at offset, zero-padded to block size."""
+    n = len(data)
+    buf = bytearray(offset + n + (-n) % block_size)
+    buf[offset:offset + n] = data
+    return buf
+
+
 def pad_to_block_size(data, block_size=16):
     """Zero-pad to block size."""
-    padding_len = (block_size - (len(data) % block_size)) % block_size
-    if len(data) % block_size != 0:
-        padding_len = block_size - (len(data) % block_size)
-    return data + bytes(padding_len)
+    return bytes(_padded_buffer(data, 0, block_size))
+
+
+def encrypt_aes128_into(secret, buf):
+    """In-place AES-128 ECB over an already zero-padded buffer."""
+    _cipher_for(bytes(secret[:CIPHER_KEY_SIZE])).encrypt(buf, output=buf)
 
 
 def encrypt_aes128(secret, plaintext):
     """AES-128 ECB with zero padding (matches MeshCore utils)."""
-    key = secret[:CIPHER_KEY_SIZE]
-    cipher = AES.new(key, AES.MODE_ECB)
-    padded = pad_to_block_size(plaintext, 16)
-    return cipher.encrypt(padded)
+    buf = _padded_buffer(plaintext)
+    encrypt_aes128_into(secret, buf)
+    return bytes(buf)
+
+
+def encrypt_then_mac_into(secret, out):
+    """In-place encryptThenMAC over out = [MAC slot][zero-padded plaintext]."""
+    with memoryview(out)[CIPHER_MAC_SIZE:] as body:
+        encrypt_aes128_into(secret, body)
+        mac_ctx = _hmac_for(bytes(secret[:PUB_KEY_SIZE])).copy()
+        mac_ctx.update(body)
+    out[:CIPHER_MAC_SIZE] = mac_ctx.digest()[:CIPHER_MAC_SIZE]
 
 
 def encrypt_then_mac(secret, plaintext):
     """MeshCore encryptThenMAC: AES-128 + HMAC-SHA256 (2-byte MAC)."""
-    encrypted = encrypt_aes128(secret, plaintext)
-    mac = HMAC.new(secret[:PUB_KEY_SIZE], encrypted, SHA256).digest()[:CIPHER_MAC_SIZE]
-    return mac + encrypted
+    out = _padded_buffer(plaintext, CIPHER_MAC_SIZE)
+    encrypt_then_mac_into(secret, out)
+    return bytes(out)
+
+
+@functools.lru_cache(maxsize=16)
+def _sender_prefix(sender_name):
+    """Cached UTF-8 "<sender>: " prefix for GRP_TXT text."""
+    return f"{sender_name}: ".encode("utf-8")
 
 
 def create_group_message_data(timestamp, sender_name, message):
     """Assemble GRP_TXT payload before encryption."""
-    data = bytearray()
-    data.extend(struct.pack('<I', timestamp))
-    data.append(0x00)  # txt_type = plain text
-    formatted = f"{sender_name}: {message}".encode("utf-8")
-    data.extend(formatted)
+    prefix = _sender_prefix(sender_name)
+    text = message.encode("utf-8")
+    data = bytearray(5 + len(prefix) + len(text))
+    _U32LE.pack_into(data, 0, timestamp)
+    data[4] = 0x00  # txt_type = plain text
+    data[5:5 + len(prefix)] = prefix
+    data[5 + len(prefix):] = text
     return bytes(data)
 
 
+def _group_text_packet_size(data_len):
+    """[header][path_len][channel_hash][MAC][ciphertext] length."""
+    return 3 + CIPHER_MAC_SIZE + data_len + (-data_len) % 16
+
+
+def write_group_text_packet(out, data):
+    """Write public channel GRP_TXT packet into a zeroed memoryview."""
+    n = len(data)
+    out[0] = (TYPE_GRP_TXT << 2) | ROUTE_FLOOD  # 0x15
+    out[1] = 0x00  # path_len = 0
+    out[2] = _PUBLIC_CHANNEL_HASH
+    out[3 + CIPHER_MAC_SIZE:3 + CIPHER_MAC_SIZE + n] = data
+    encrypt_then_mac_into(_PUBLIC_SECRET, out[3:])
+
+
 def create_group_text_packet(sender_name, message):
     """Build full MeshCore packet for public channel GRP_TXT."""
-    secret = get_public_channel_secret()
-    channel_hash = get_public_channel_hash(secret)
+    frame = create_group_text_frame(sender_name, message)
+    return frame[4:-2]  # strip magic, length and checksum
+
 
+def create_group_text_frame(sender_name, message):
+    """Build public channel GRP_TXT packet directly inside its RS232 frame."""
     timestamp = int(time.time())
     data = create_group_message_data(timestamp, sender_name, message)
+    return fill_rs232_frame(_group_text_packet_size(len(data)),
+                            functools.partial(write_group_text_packet, data=data))
 
-    encrypted = encrypt_then_mac(secret, data)
 
-    payload = bytearray()
-    payload.append(channel_hash)
-    payload.extend(encrypted)
+def fill_rs232_frame(length, write):
+    """RS232Bridge frame whose packet is written in place by write(view)"""
+    frame = bytearray(4 + length + 2)
+    _RS232_HEADER.pack_into(frame, 0, RS232_MAGIC, length)
+    with memoryview(frame)[4:4 + length] as packet:
+        write(packet)
+        checksum = fletcher16(packet)
+    frame[4 + length:] = checksum
+    return bytes(frame)
 
-    header = (TYPE_GRP_TXT << 2) | ROUTE_FLOOD  # 0x15
-
-    packet = bytearray()
-    packet.append(header)
-    packet.append(0x00)  # path_len = 0
-    packet.extend(payload)
-    return bytes(packet)
 
 def create_rs232_frame(packet):
     """Wrap packet in RS232Bridge frame"""
-    magic = bytes([0xC0, 0x3E])
-    length = struct.pack(">H", len(packet))
-    checksum = fletcher16(packet)
-    return magic + length + packet + checksum
-
-def read_rs232_frame(sock):
-    """Read RS232Bridge frame from socket"""
-    # Magic
-    magic = sock.recv(2)
-    if len(magic) < 2 or magic[0] != 0xC0 or magic[1] != 0x3E:
-        return None
-    
-    # Length
-    length_bytes = sock.recv(2)
-    if len(length_bytes) < 2:
-        return None
-    length = struct.unpack(">H", length_bytes)[0]
-    
-    # Packet
-    packet = b""
-    while len(packet) < length:
-        chunk = sock.recv(length - len(packet))
-        if not chunk:
-            return None
-        packet += chunk
-    
-    # Checksum
-    checksum = sock.recv(2)
-    if len(checksum) < 2:
-        return None
-    
-    # Skip newline delimiter (device sends \n after checksum)
-    newline = sock.recv(1)
-    if newline and newline != b'\n':
-        print(f"[!] Warning: expected newline, got {newline.hex()}")
-    
-    # Verify
-    calc = fletcher16(packet)
-    if calc != checksum:
-        print(f"[!] Checksum error: {checksum.hex()} != {calc.hex()}")
-        return None
-    
-    return packet
+    def copy(view):
+        view[:] = packet
+    return fill_rs232_frame(len(packet), copy)
+
+
+class FrameReader:
+    """Buffered RS232Bridge reader - one recv can yield many frames"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = bytearray()
+        self.pos = 0  # start of unparsed data in buf
+        self.slab = bytearray(RECV_SLAB_SIZE)
+        self.junk = 0  # stray bytes (not CR/LF) since the last frame
+        self.junk_reported = False  # already reported as a bad frame
+
+    def recv_some(self):
+        """Append whatever the socket has to the buffer; False on EOF"""
+        n = self.sock.recv_into(self.slab)
+        if not n:
+            return False
+        if self.pos == len(self.buf) or self.pos >= RECV_COMPACT_THRESHOLD:
+            del self.buf[:self.pos]
+            self.pos = 0
+        self.buf += memoryview(self.slab)[:n]
+        return True
+
+    def parse_frames(self):
+        """Yield every complete, checksum-valid packet in the buffer"""
+        buf = self.buf
+        while True:
+            start = buf.find(RS232_MAGIC, self.pos)
+            if start < 0:
+                # Keep an unconsumed trailing magic byte, the rest may still arrive
+                end = len(buf)
+                if end > self.pos and buf.endswith(RS232_MAGIC[:1]):
+                    end -= 1
+                self._skip(end)
+                return
+            self._skip(start)
+            self._report_junk()
+
+            # Magic + length
+            if len(buf) - start < 4:
+                return
+            length = _U16BE.unpack_from(buf, start + 2)[0]
+            if length > MAX_PACKET_SIZE:
+                # Not a real header - resync from the next byte
+                print(f"[!] Bad frame length {length}")
+                self.pos = start + 1
+                self.junk_reported = True
+                continue
+
+            # Packet + checksum (the trailing \n is skipped as inter-frame data)
+            end = start + 4 + length
+            if len(buf) < end + 2:
+                return
+            packet = bytes(buf[start + 4:end])
+            checksum = bytes(buf[end:end + 2])
+
+            # Verify
+            calc = fletcher16(packet)
+            if calc != checksum:
+                # The length may have been bogus too - resync from the next byte
+                print(f"[!] Checksum error: {checksum.hex()} != {calc.hex()}")
+                self.pos = start + 1
+                self.junk_reported = True
+                continue
+
+            self.pos = end + 2
+            yield packet
+
+    def _skip(self, end):
+        """Drop bytes up to end, counting any that are not newline delimiters"""
+        self.junk += len(self.buf[self.pos:end].translate(None, b"\r\n"))
+        self.pos = end
+
+    def _report_junk(self):
+        """Warn once per run of stray bytes, unless it was a reported bad frame"""
+        if self.junk and not self.junk_reported:
+            print(f"[!] Warning: skipped {self.junk} bytes outside a frame")
+        self.junk = 0
+        self.junk_reported = False
+
 
 def display_packet(packet):
     """Display packet info"""
@@ -166,52 +291,113 @@ def display_packet(packet):
     payload_start = 3 + path_len
     payload = packet[payload_start:payload_start + payload_len]
     
-    route_names = {0: "DIRECT", 1: "FLOOD", 2: "TRANSPORT"}
-    type_names = {0: "TXT_MSG", 3: "ACK", 4: "ADVERT", 5: "GRP_TXT"}
+    route_name = _ROUTE_NAMES.get(route, f'0x{route:02X}')
+    type_name = _TYPE_NAMES.get(ptype, f'0x{ptype:02X}')
+    payload_hex = payload[:32].hex() + ('...' if len(payload) > 32 else '')
     
-    print(f"\n{'='*60}")
-    print(f"📨 RX [{datetime.now().strftime('%H:%M:%S')}]")
-    print(f"{'='*60}")
-    print(f"Route: {route_names.get(route, f'0x{route:02X}')}")
-    print(f"Type:  {type_names.get(ptype, f'0x{ptype:02X}')}")
-    print(f"Payload: {payload[:32].hex()}{'...' if len(payload) > 32 else ''}")
-    print(f"{'='*60}")
+    # One write per packet instead of a print() per line
+    sys.stdout.write(
+        f"\n{_BAR}\n"
+        f"📨 RX [{datetime.now().strftime('%H:%M:%S')}]\n"
+        f"{_BAR}\n"
+        f"Route: {route_name}\n"
+        f"Type:  {type_name}\n"
+        f"Payload: {payload_hex}\n"
+        f"{_BAR}\n"
+    )
 
 
 def send_group_text(sock, message, sender_name):
     """Construct and send GRP_TXT packet via RS232 bridge."""
-    packet = create_group_text_packet(sender_name, message)
-    frame = create_rs232_frame(packet)
+    frame = create_group_text_frame(sender_name, message)
     sock.sendall(frame)
-    print(f"[✓] Sent text as '{sender_name}' ({len(packet)}B packet)")
+    packet_len = len(frame) - 6  # magic, length, checksum
+    print(f"[✓] Sent text as '{sender_name}' ({packet_len}B packet)")
+
+
+def receive_ready(reader, received):
+    """Drain the readable socket; False once the bridge is gone"""
+    try:
+        if not reader.recv_some():
+            return False
+    except OSError:
+        return False
+    for packet in reader.parse_frames():
+        received[0] += 1
+        display_packet(packet)
+        print("> ", end="", flush=True)
+    return True
+
+
+def stdin_ready(sock, sender, pending):
+    """Run every complete line typed on stdin; False on quit or EOF"""
+    data = os.read(sys.stdin.fileno(), 4096)
+    pending += data
+    lines = pending.split(b"\n")
+    if data:
+        pending[:] = lines.pop()  # keep the unfinished line
+    else:
+        pending.clear()
+    for line in lines:
+        if not handle_command(sock, line.decode("utf-8", "replace").strip(), sender):
+            return False
+    if not data:
+        return False
+    print("> ", end="", flush=True)
+    return True
+
+
+def handle_command(sock, cmd, sender):
+    """Run one interactive command; False on quit"""
+    if not cmd:
+        return True
+    
+    lower = cmd.lower()
+
+    if lower in ['quit', 'exit', 'q']:
+        return False
+
+    if lower.startswith(("msg ", "/msg ", "text ", "/text ")):
+        text = cmd.split(" ", 1)[1].strip() if " " in cmd else ""
+        if text:
+            send_group_text(sock, text, sender[0])
+        else:
+            print("[!] No text provided")
+        return True
+
+    if lower.startswith(("name ", "/name ")):
+        new_name = cmd.split(" ", 1)[1].strip()
+        if new_name:
+            sender[0] = new_name
+            print(f"[*] Sender changed to {sender[0]}")
+        else:
+            print("[!] No name provided")
+        return True
+
+    # Assume hex packet
+    send_packet(sock, cmd)
+    return True
+
+
+@functools.lru_cache(maxsize=16)
+def _raw_packet_frame(packet_hex):
+    """Cached hex parse + framing, the same packet is often re-sent"""
+    packet = bytes.fromhex(packet_hex.replace(" ", ""))
+    return create_rs232_frame(packet)
 
-def receiver_thread(sock, running):
-    """Background receiver"""
-    count = 0
-    while running[0]:
-        try:
-            packet = read_rs232_frame(sock)
-            if packet is None:
-                break
-            count += 1
-            display_packet(packet)
-            print("> ", end="", flush=True)
-        except:
-            break
-    print(f"\n[*] Receiver stopped ({count} packets)")
 
 def send_packet(sock, packet_hex):
     """Send raw packet"""
     try:
-        packet = bytes.fromhex(packet_hex.replace(" ", ""))
-        frame = create_rs232_frame(packet)
+        frame = _raw_packet_frame(packet_hex)
         sock.sendall(frame)
-        print(f"[✓] Sent {len(packet)} bytes")
+        print(f"[✓] Sent {len(frame) - 6} bytes")
         return True
     except Exception as e:
         print(f"[!] Error: {e}")
         return False
 
+
 def main():
     if len(sys.argv) < 2:
         print("Usage:")
@@ -229,11 +415,17 @@ def main():
     
     host = sys.argv[1]
     port = int(sys.argv[2]) if len(sys.argv) > 2 else 5002
-    sender_name = sys.argv[3] if len(sys.argv) > 3 else f"Bot{random.randint(1, 999)}"
+    sender_name = sys.argv[3] if len(sys.argv) > 3 else f"Bot{int.from_bytes(os.urandom(2), 'little') % 999 + 1}"
     
     print(f"[*] Connecting to {host}:{port}...")
     
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Frames are small and interactive: no Nagle delay, room for RX bursts,
+    # keepalive to notice a bridge that vanished. RCVBUF must be set before
+    # connect() so the window scale is negotiated for it.
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_RCVBUF_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
     
     try:
         sock.connect((host, port))
@@ -242,52 +434,38 @@ def main():
         print(f"\nType hex packet to send, or 'msg <text>' to auto-build public packet, or 'quit' to exit")
         print(f"{'='*60}\n")
         
-        # Start receiver
-        running = [True]
-        receiver = threading.Thread(target=receiver_thread, args=(sock, running), daemon=True)
-        receiver.start()
-        
-        # Interactive loop
-        while running[0]:
+        # One thread multiplexes the bridge socket and stdin
+        reader = FrameReader(sock)
+        received = [0]
+        sender = [sender_name]
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ,
+                     functools.partial(receive_ready, reader, received))
+        try:
             try:
-                cmd = input("> ").strip()
-                
-                if not cmd:
-                    continue
-                
-                if cmd.lower() in ['quit', 'exit', 'q']:
-                    running[0] = False
-                    break
-                
-                lower = cmd.lower()
-
-                if lower.startswith(("msg ", "/msg ", "text ", "/text ")):
-                    text = cmd.split(" ", 1)[1].strip() if " " in cmd else ""
-                    if text:
-                        send_group_text(sock, text, sender_name)
-                    else:
-                        print("[!] No text provided")
-                    continue
-
-                if lower.startswith(("name ", "/name ")):
-                    new_name = cmd.split(" ", 1)[1].strip()
-                    if new_name:
-                        sender_name = new_name
-                        print(f"[*] Sender changed to {sender_name}")
-                    else:
-                        print("[!] No name provided")
-                    continue
-
-                # Assume hex packet
-                send_packet(sock, cmd)
-                
-            except KeyboardInterrupt:
-                print("\n[*] Interrupted")
-                running[0] = False
-                break
-            except EOFError:
-                running[0] = False
-                break
+                sel.register(sys.stdin, selectors.EVENT_READ,
+                             functools.partial(stdin_ready, sock, sender, bytearray()))
+                running = True
+            except PermissionError:
+                # epoll rejects regular files (stdin redirected from a file),
+                # so just run the commands in order
+                for line in sys.stdin:
+                    if not handle_command(sock, line.strip(), sender):
+                        break
+                running = False
+            
+            if running:
+                print("> ", end="", flush=True)
+            while running:
+                for key, _ in sel.select():
+                    if not key.data():
+                        running = False
+                        break
+        except KeyboardInterrupt:
+            print("\n[*] Interrupted")
+        finally:
+            sel.close()
+        print(f"\n[*] Receiver stopped ({received[0]} packets)")
     
     except ConnectionRefusedError:
         print(f"[!] Cannot connect to {host}:{port}")
@@ -298,5 +476,6 @@ def main():
         sock.close()
         print("[✓] Disconnected")
 
+
 if __name__ == "__main__":
     main()